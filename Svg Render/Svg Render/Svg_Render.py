@@ -1,31 +1,51 @@
 ﻿import sys
+import os
 import re
 import json
+import asyncio
 import logging
-import multiprocessing
-from dataclasses import dataclass
-from typing import List, Optional, Dict, Any
+import functools
+import threading
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import List, Optional, Dict, Any, Tuple, Deque
+from itertools import chain, count, islice
 from enum import Enum
 from datetime import datetime
 from xml.dom import minidom
 import xml.etree.ElementTree as ET
 import html
 import markdown
-import base64
+import ollama
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
 
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout,
     QHBoxLayout, QTextEdit, QLabel, QSplitter, QMessageBox,
     QToolBar, QStatusBar, QFileDialog, QFontDialog, QPushButton,
-    QFrame, QScrollArea, QLineEdit, QTabWidget, QTextBrowser,
-    QSizePolicy, QSpacerItem
+    QFrame, QScrollArea, QLineEdit, QTabWidget, QSizePolicy
 )
 from PySide6.QtSvgWidgets import QSvgWidget
 from PySide6.QtSvg import QSvgRenderer
-from PySide6.QtCore import QByteArray, Qt, QSize, QRectF, QObject, QThread, Signal, QPointF
+from PySide6.QtCore import QByteArray, Qt, QSize, QRectF, QObject, Signal, QTimer, QXmlStreamReader
 from PySide6.QtGui import (
     QIcon, QFont, QTextCharFormat, QSyntaxHighlighter,
-    QPalette, QColor, QPainter, QPixmap, QPainterPath, QPen, QBrush
+    QPalette, QColor, QPainter, QPixmap
 )
 
 logging.basicConfig(
@@ -35,28 +55,79 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-class OllamaWorker(QObject):
-    finished = Signal(str)
-    error = Signal(str)
+class AsyncOllamaWorker(QObject):
+    # Every signal carries the id submit() returned, so a receiver can drop
+    # output from requests it has abandoned.
+    chunk = Signal(int, str)
+    finished = Signal(int, str)
+    error = Signal(int, str)
 
-    def __init__(self, model_name: str, messages: List[Dict], options: Dict):
-        super().__init__()
-        self.model_name = model_name
-        self.messages = messages
-        self.options = options
+    def __init__(self, host: Optional[str] = None, parent=None):
+        super().__init__(parent)
+        self.host = host
+        self._client: Optional[ollama.AsyncClient] = None
+        self._request_ids = count(1)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._run_loop, name="OllamaEventLoop", daemon=True
+        )
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def _get_client(self) -> ollama.AsyncClient:
+        # The client's HTTP transport is bound to the loop it is created on,
+        # so it is built lazily from inside the loop thread.
+        if self._client is None:
+            self._client = ollama.AsyncClient(host=self.host)
+        return self._client
+
+    async def _chat(self, request_id: int, model_name: str, messages: List[Dict], options: Dict, stream: bool = False) -> str:
+        response = await self._get_client().chat(
+            model=model_name,
+            messages=messages,
+            options=options,
+            stream=stream
+        )
+        if not stream:
+            return response['message']['content']
+
+        parts = []
+        async for part in response:
+            content = part['message']['content']
+            if content:
+                parts.append(content)
+                self.chunk.emit(request_id, content)
+        return ''.join(parts)
+
+    def _emit_result(self, request_id: int, future: Future):
+        if future.cancelled():
+            return
+        exc = future.exception()
+        if exc is not None:
+            logger.error(f"Error in AsyncOllamaWorker: {exc}")
+            self.error.emit(request_id, str(exc))
+            return
+        self.finished.emit(request_id, future.result())
 
-    def run(self):
-        try:
-            import ollama
-            response = ollama.chat(
-                model=self.model_name,
-                messages=self.messages,
-                options=self.options
-            )
-            self.finished.emit(response['message']['content'])
-        except Exception as e:
-            logger.error(f"Error in OllamaWorker thread: {e}")
-            self.error.emit(str(e))
+    def _schedule(self, request_id: int, coro) -> Future:
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        future.add_done_callback(
+            lambda f: self._loop.call_soon_threadsafe(self._emit_result, request_id, f)
+        )
+        return future
+
+    def submit(self, model_name: str, messages: List[Dict], options: Dict, stream: bool = False) -> Tuple[int, Future]:
+        request_id = next(self._request_ids)
+        future = self._schedule(request_id, self._chat(request_id, model_name, messages, options, stream))
+        return request_id, future
+
+    def shutdown(self):
+        if self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=2)
 
 
 class Theme:
@@ -128,24 +199,30 @@ THEMES = {
     }
 }
 
+THEME_QCOLORS = {
+    name: {key: QColor(value) for key, value in colors.items()}
+    for name, colors in THEMES.items()
+}
+
 def get_palette(theme_name: str) -> QPalette:
-    colors = THEMES[theme_name]
+    colors = THEME_QCOLORS[theme_name]
     palette = QPalette()
-    palette.setColor(QPalette.ColorRole.Window, QColor(colors["Window"]))
-    palette.setColor(QPalette.ColorRole.WindowText, QColor(colors["WindowText"]))
-    palette.setColor(QPalette.ColorRole.Base, QColor(colors["Base"]))
-    palette.setColor(QPalette.ColorRole.AlternateBase, QColor(colors["AlternateBase"]))
-    palette.setColor(QPalette.ColorRole.ToolTipBase, QColor(colors["ToolTipBase"]))
-    palette.setColor(QPalette.ColorRole.ToolTipText, QColor(colors["ToolTipText"]))
-    palette.setColor(QPalette.ColorRole.Text, QColor(colors["Text"]))
-    palette.setColor(QPalette.ColorRole.Button, QColor(colors["Button"]))
-    palette.setColor(QPalette.ColorRole.ButtonText, QColor(colors["ButtonText"]))
-    palette.setColor(QPalette.ColorRole.BrightText, QColor(colors["BrightText"]))
-    palette.setColor(QPalette.ColorRole.Link, QColor(colors["Link"]))
-    palette.setColor(QPalette.ColorRole.Highlight, QColor(colors["Highlight"]))
-    palette.setColor(QPalette.ColorRole.HighlightedText, QColor(colors["HighlightedText"]))
+    palette.setColor(QPalette.ColorRole.Window, colors["Window"])
+    palette.setColor(QPalette.ColorRole.WindowText, colors["WindowText"])
+    palette.setColor(QPalette.ColorRole.Base, colors["Base"])
+    palette.setColor(QPalette.ColorRole.AlternateBase, colors["AlternateBase"])
+    palette.setColor(QPalette.ColorRole.ToolTipBase, colors["ToolTipBase"])
+    palette.setColor(QPalette.ColorRole.ToolTipText, colors["ToolTipText"])
+    palette.setColor(QPalette.ColorRole.Text, colors["Text"])
+    palette.setColor(QPalette.ColorRole.Button, colors["Button"])
+    palette.setColor(QPalette.ColorRole.ButtonText, colors["ButtonText"])
+    palette.setColor(QPalette.ColorRole.BrightText, colors["BrightText"])
+    palette.setColor(QPalette.ColorRole.Link, colors["Link"])
+    palette.setColor(QPalette.ColorRole.Highlight, colors["Highlight"])
+    palette.setColor(QPalette.ColorRole.HighlightedText, colors["HighlightedText"])
     return palette
 
+@functools.lru_cache(maxsize=2)
 def get_stylesheet(theme_name: str) -> str:
     colors = THEMES[theme_name]
     return f"""
@@ -298,29 +375,47 @@ class MessageRole(Enum):
     USER = "user"
     ASSISTANT = "assistant"
 
-@dataclass
+# dataclass(slots=True) needs Python 3.10; older interpreters keep a __dict__.
+_DATACLASS_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+@dataclass(**_DATACLASS_SLOTS)
 class Message:
     role: MessageRole
     content: str
     timestamp: float = None
+    _rendered_html: Optional[str] = field(default=None, init=False, repr=False, compare=False)
+    _dict: Optional[Dict[str, Any]] = field(default=None, init=False, repr=False, compare=False)
 
     def __post_init__(self):
         self.timestamp = self.timestamp or datetime.now().timestamp()
 
     def to_dict(self) -> Dict[str, Any]:
-        return {
-            "role": self.role.value,
-            "content": self.content,
-            "timestamp": self.timestamp
-        }
+        # Messages are never edited once created, so the dict is built once
+        # and reused for every request that includes this message.
+        if self._dict is None:
+            self._dict = {
+                "role": self.role.value,
+                "content": self.content,
+                "timestamp": self.timestamp
+            }
+        return self._dict
 
 class ChatSession:
-    def __init__(self, session_id: str = None):
+    __slots__ = ('session_id', 'messages', 'system_prompt', 'model_config', '_system_message', '_archive')
+
+    def __init__(self, session_id: str = None, max_history: int = 1000):
         self.session_id = session_id or str(int(datetime.now().timestamp()))
-        self.messages: List[Message] = []
+        self.messages: Deque[Message] = deque(maxlen=max_history)
         self.system_prompt: Optional[str] = None
+        self.model_config: Optional['AIModelConfig'] = None
+        self._system_message: Optional[Message] = None
+        # Messages that rolled off the live window; kept only so that saving
+        # writes the full history back.
+        self._archive: List[Message] = []
 
     def add_message(self, message: Message):
+        if len(self.messages) == self.messages.maxlen:
+            self._archive.append(self.messages[0])
         self.messages.append(message)
 
     def set_system_prompt(self, prompt: str):
@@ -329,30 +424,49 @@ class ChatSession:
     def get_context_window(self, max_messages: int = 10) -> List[Message]:
         messages = []
         if self.system_prompt:
-            messages.append(Message(
-                role=MessageRole.SYSTEM,
-                content=self.system_prompt
-            ))
-        messages.extend(self.messages[-max_messages:])
+            if self._system_message is None or self._system_message.content != self.system_prompt:
+                self._system_message = Message(
+                    role=MessageRole.SYSTEM,
+                    content=self.system_prompt
+                )
+            messages.append(self._system_message)
+        # Walk the deque from the right so only the tail is visited.
+        recent = list(islice(reversed(self.messages), max_messages))
+        recent.reverse()
+        messages.extend(recent)
         return messages
 
     def save_to_file(self, filepath: str):
         data = {
             "session_id": self.session_id,
             "system_prompt": self.system_prompt,
-            "messages": [msg.to_dict() for msg in self.messages]
+            "messages": [msg.to_dict() for msg in chain(self._archive, self.messages)]
         }
-        with open(filepath, 'w') as f:
-            json.dump(data, f, indent=2)
+        if self.model_config:
+            data["model_config"] = self.model_config.to_dict()
+        if orjson:
+            with open(filepath, 'wb') as f:
+                f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        else:
+            with open(filepath, 'w') as f:
+                json.dump(data, f, indent=2)
 
     @classmethod
     def load_from_file(cls, filepath: str) -> 'ChatSession':
-        with open(filepath, 'r') as f:
-            data = json.load(f)
+        with open(filepath, 'rb') as f:
+            raw = f.read()
+        data = orjson.loads(raw) if orjson else json.loads(raw)
 
         session = cls(session_id=data["session_id"])
         session.system_prompt = data["system_prompt"]
-        session.messages = [
+        if data.get("model_config"):
+            # Ignore keys this version doesn't know so older or newer session
+            # files still load.
+            session.model_config = AIModelConfig(**{
+                key: value for key, value in data["model_config"].items()
+                if key in AIModelConfig.__slots__
+            })
+        messages = [
             Message(
                 role=MessageRole(msg["role"]),
                 content=msg["content"],
@@ -360,9 +474,27 @@ class ChatSession:
             )
             for msg in data["messages"]
         ]
+        # A longer saved history keeps only its tail live; the rest is
+        # archived so the next save doesn't drop it.
+        overflow = len(messages) - (session.messages.maxlen or len(messages))
+        if overflow > 0:
+            session._archive.extend(messages[:overflow])
+        session.messages.extend(messages)
         return session
 
+def default_num_thread() -> int:
+    physical_cores = psutil.cpu_count(logical=False) if psutil else None
+    if not physical_cores:
+        physical_cores = (os.cpu_count() or 2) // 2
+    return max(1, physical_cores)
+
 class AIModelConfig:
+    __slots__ = (
+        'model_name', 'temperature', 'max_tokens', 'top_p',
+        'frequency_penalty', 'presence_penalty',
+        'num_thread', 'num_ctx', 'num_batch'
+    )
+
     def __init__(
         self,
         model_name: str = "qwen3:8b",
@@ -371,6 +503,9 @@ class AIModelConfig:
         top_p: float = 0.95,
         frequency_penalty: float = 0.0,
         presence_penalty: float = 0.0,
+        num_thread: Optional[int] = None,
+        num_ctx: Optional[int] = None,
+        num_batch: Optional[int] = None,
     ):
         self.model_name = model_name
         self.temperature = temperature
@@ -378,8 +513,43 @@ class AIModelConfig:
         self.top_p = top_p
         self.frequency_penalty = frequency_penalty
         self.presence_penalty = presence_penalty
+        # Left as None unless set explicitly so saved sessions stay portable;
+        # the host's core count is resolved when the request is built.
+        self.num_thread = num_thread
+        self.num_ctx = num_ctx
+        self.num_batch = num_batch
+
+    def to_options(self) -> Dict[str, Any]:
+        options = {
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "num_predict": self.max_tokens,
+            "frequency_penalty": self.frequency_penalty,
+            "presence_penalty": self.presence_penalty,
+            "num_thread": self.num_thread or default_num_thread()
+        }
+        if self.num_ctx is not None:
+            options["num_ctx"] = self.num_ctx
+        if self.num_batch is not None:
+            options["num_batch"] = self.num_batch
+        return options
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "model_name": self.model_name,
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+            "top_p": self.top_p,
+            "frequency_penalty": self.frequency_penalty,
+            "presence_penalty": self.presence_penalty,
+            "num_thread": self.num_thread,
+            "num_ctx": self.num_ctx,
+            "num_batch": self.num_batch
+        }
 
 class SVGExpertAgent:
+    __slots__ = ('session', 'model_config')
+
     def __init__(self):
         self.session = ChatSession()
         self.model_config = AIModelConfig(
@@ -387,6 +557,7 @@ class SVGExpertAgent:
             temperature=0.7,
             max_tokens=20000
         )
+        self.session.model_config = self.model_config
 
         self.session.set_system_prompt("""You are a specialized SVG code generation assistant.
 Your sole purpose is to provide valid, complete SVG code based on user requests.
@@ -417,13 +588,7 @@ Failure to adhere to this format will render your output useless. Do not fail.""
         context = self.session.get_context_window()
 
         messages = [msg.to_dict() for msg in context]
-        options = {
-            "temperature": self.model_config.temperature,
-            "top_p": self.model_config.top_p,
-            "num_predict": self.model_config.max_tokens,
-            "frequency_penalty": self.model_config.frequency_penalty,
-            "presence_penalty": self.model_config.presence_penalty
-        }
+        options = self.model_config.to_options()
 
         callback(self.model_config.model_name, messages, options)
 
@@ -432,6 +597,10 @@ Failure to adhere to this format will render your output useless. Do not fail.""
 
     def load_session(self, filepath: str):
         self.session = ChatSession.load_from_file(filepath)
+        if self.session.model_config:
+            self.model_config = self.session.model_config
+        else:
+            self.session.model_config = self.model_config
 
 class ModernButton(QPushButton):
     def __init__(self, text, icon_name=None, parent=None):
@@ -444,30 +613,104 @@ class ScalableSvgWidget(QSvgWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setMinimumSize(700, 700)
+        self._svg_default_size: Optional[QSize] = None
+        self._cached_size: Optional[QSize] = None
+        self._cached_rect: Optional[QRectF] = None
+        self._pixmap_cache: Optional[QPixmap] = None
+        self._cache_key: Optional[Tuple[Optional[int], QSize, float]] = None
+        self._last_text: Optional[str] = None
+        self._last_hash: Optional[int] = None
+        self._svg_bytes = QByteArray()
+
+    def load_svg(self, text: str) -> bool:
+        # Compare the text itself; a hash collision must never skip a render.
+        if text == self._last_text:
+            return False
+        self._last_text = text
+        self._last_hash = hash(text)
+        # QSvgRenderer parses during load(), so the buffer can be reused.
+        self._svg_bytes.clear()
+        self._svg_bytes.append(text.encode('utf-8'))
+        self.load(self._svg_bytes)
+        self.update()
+        return True
+
+    def load(self, contents):
+        super().load(contents)
+        self._svg_default_size = self.renderer().defaultSize()
+        self._cached_size = None
+        self._cached_rect = None
+        self._pixmap_cache = None
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self._pixmap_cache = None
+
+    def _target_rect(self) -> QRectF:
+        if self.size() != self._cached_size:
+            scaled_size = self._svg_default_size.scaled(self.width(), self.height(), Qt.AspectRatioMode.KeepAspectRatio)
+
+            x = (self.width() - scaled_size.width()) / 2
+            y = (self.height() - scaled_size.height()) / 2
+
+            self._cached_rect = QRectF(x, y, scaled_size.width(), scaled_size.height())
+            self._cached_size = self.size()
+        return self._cached_rect
+
+    def _rasterize(self, target: QRectF) -> QPixmap:
+        dpr = self.devicePixelRatioF()
+        pixmap = QPixmap(self.size() * dpr)
+        pixmap.setDevicePixelRatio(dpr)
+        pixmap.fill(Qt.GlobalColor.transparent)
+
+        painter = QPainter(pixmap)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        self.renderer().render(painter, target)
+        painter.end()
+        return pixmap
 
     def paintEvent(self, event):
         if not self.renderer().isValid():
             return
 
-        painter = QPainter(self)
-        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
-
-        viewport = QRectF(0, 0, self.width(), self.height())
-        svg_size = self.renderer().defaultSize()
+        if self._svg_default_size is None:
+            self._svg_default_size = self.renderer().defaultSize()
+        target = self._target_rect()
 
-        scaled_size = svg_size.scaled(self.width(), self.height(), Qt.AspectRatioMode.KeepAspectRatio)
+        painter = QPainter(self)
 
-        x = (self.width() - scaled_size.width()) / 2
-        y = (self.height() - scaled_size.height()) / 2
+        # Animated SVGs change every frame, so they bypass the raster cache.
+        if self.renderer().animated():
+            painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+            self.renderer().render(painter, target)
+            return
 
-        self.renderer().render(painter, QRectF(x, y, scaled_size.width(), scaled_size.height()))
+        cache_key = (self._last_hash, self.size(), self.devicePixelRatioF())
+        if self._pixmap_cache is None or cache_key != self._cache_key:
+            self._pixmap_cache = self._rasterize(target)
+            self._cache_key = cache_key
+        painter.drawPixmap(0, 0, self._pixmap_cache)
 
 class SVGHighlighter(QSyntaxHighlighter):
+    # Alternatives are ordered so that comments win over values, and values
+    # over tags/attributes, matching the old rule-by-rule overwrite order.
+    _TOKEN_RE = re.compile(
+        r'(?P<comment><!--[\s\S]*?-->)'
+        r'|(?P<value>"[^"]*")'
+        r'|(?P<tag></?[\w:-]+|/?>)'
+        r'|(?P<attribute>[\w:-]+(?=\=))'
+    )
+
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.highlighting_rules = []
+        self._fmt_by_group: Dict[str, QTextCharFormat] = {}
         self.theme_colors = THEMES[Theme.DARK]
 
+        self._rehighlight_timer = QTimer(self)
+        self._rehighlight_timer.setSingleShot(True)
+        self._rehighlight_timer.setInterval(0)
+        self._rehighlight_timer.timeout.connect(self.rehighlight)
+
         self.tag_format = QTextCharFormat()
         self.tag_format.setFontWeight(QFont.Weight.Bold)
 
@@ -485,19 +728,29 @@ class SVGHighlighter(QSyntaxHighlighter):
         self.value_format.setForeground(QColor(colors["EditorValue"]))
         self.comment_format.setForeground(QColor(colors["EditorComment"]))
 
-        self.highlighting_rules = [
-            (re.compile(r'</?[\w:-]+'), self.tag_format),
-            (re.compile(r'>|/>'), self.tag_format),
-            (re.compile(r'[\w:-]+(?=\=)'), self.attribute_format),
-            (re.compile(r'"[^"]*"'), self.value_format),
-            (re.compile(r'<!--[\s\S]*?-->'), self.comment_format)
-        ]
-        self.rehighlight()
+        self._fmt_by_group = {
+            "comment": self.comment_format,
+            "value": self.value_format,
+            "tag": self.tag_format,
+            "attribute": self.attribute_format
+        }
+        self._rehighlight_timer.start()
 
     def highlightBlock(self, text):
-        for pattern, format in self.highlighting_rules:
-            for match in pattern.finditer(text):
-                self.setFormat(match.start(), match.end() - match.start(), format)
+        # finditer yields tokens in order, so touching tokens with the same
+        # format (e.g. "<g" and ">") are merged into one setFormat call.
+        run_start = run_end = 0
+        run_format = None
+        for match in self._TOKEN_RE.finditer(text):
+            fmt = self._fmt_by_group[match.lastgroup]
+            if fmt is run_format and match.start() == run_end:
+                run_end = match.end()
+                continue
+            if run_format is not None:
+                self.setFormat(run_start, run_end - run_start, run_format)
+            run_start, run_end, run_format = match.start(), match.end(), fmt
+        if run_format is not None:
+            self.setFormat(run_start, run_end - run_start, run_format)
 
 class PreviewFrame(QFrame):
     def __init__(self, parent=None):
@@ -524,10 +777,12 @@ class PreviewFrame(QFrame):
         self.scroll_area.setStyleSheet(f"background-color: {color}; border: none;")
 
 class ChatMessageWidget(QWidget):
-    def __init__(self, text, is_user, theme_colors, parent=None):
+    def __init__(self, body, is_user, theme_colors, styles="", rich=True, parent=None):
         super().__init__(parent)
         self.is_user = is_user
         self.theme_colors = theme_colors
+        self.body = body
+        self.rich = rich
 
         layout = QHBoxLayout(self)
         layout.setContentsMargins(0, 0, 0, 0)
@@ -541,7 +796,11 @@ class ChatMessageWidget(QWidget):
         bubble_layout.setSpacing(0)
 
         self.text_display = QLabel()
-        self.text_display.setText(text)
+        if rich:
+            self.text_display.setText(f'{styles}{body}')
+        else:
+            self.text_display.setTextFormat(Qt.TextFormat.PlainText)
+            self.text_display.setText(body)
         self.text_display.setWordWrap(True)
         self.text_display.setOpenExternalLinks(True)
         self.text_display.setTextInteractionFlags(Qt.TextInteractionFlag.TextBrowserInteraction)
@@ -588,18 +847,82 @@ class ChatMessageWidget(QWidget):
                 text-decoration: underline;
             }}
         """)
-        self.text_display.setText(self.text_display.text())
+
+    def restyle(self, theme_colors, styles: str):
+        self.update_theme(theme_colors)
+        if self.rich:
+            self.text_display.setText(f'{styles}{self.body}')
+
+_SVG_BLOCK_RE = re.compile(r'```(?:xml|svg)\s*\n([\s\S]*?)\n```')
+
+def find_svg_block(text: str) -> Optional[Tuple[int, int, str]]:
+    # Linear str.find scan for the first ```xml / ```svg block, returning
+    # (block_start, block_end, code). Falls back to _SVG_BLOCK_RE for the
+    # few layouts the scan does not cover, such as an empty block.
+    fence = text.find('```')
+    while fence != -1:
+        lang_end = fence + 6
+        if text[fence + 3:lang_end] in ('xml', 'svg'):
+            whitespace_end = lang_end
+            while whitespace_end < len(text) and text[whitespace_end].isspace():
+                whitespace_end += 1
+            newline = text.rfind('\n', lang_end, whitespace_end)
+            if newline != -1:
+                close = text.find('\n```', newline + 1)
+                if close == -1:
+                    break
+                return fence, close + 4, text[newline + 1:close]
+        fence = text.find('```', fence + 1)
+
+    match = _SVG_BLOCK_RE.search(text)
+    if match:
+        return match.start(), match.end(), match.group(1)
+    return None
 
 class ModernChatWidget(QWidget):
+    # Anything markdown could turn into markup: inline syntax, raw HTML or
+    # entities, block markers at line start, paragraph breaks, hard breaks.
+    _MARKDOWN_SYNTAX_RE = re.compile(r'[`*_#\[\]<>&\\]|^\s*(?:[-+=]|\d+\.)|^(?: {4}|\t)|\n\s*\n| {2}\n', re.MULTILINE)
+    _SVG_NOTE_HTML = '<blockquote>\n<p>[SVG code has been inserted into the editor]</p>\n</blockquote>'
+    # Retry prompts are sent to the model but never drawn; this prefix marks
+    # them, including in sessions loaded from disk.
+    _REPROMPT_PREFIX = "Your previous response was invalid."
+
     def __init__(self, editor, parent=None):
         super().__init__(parent)
         self.editor = editor
         self.agent = SVGExpertAgent()
         self.theme_colors = THEMES[Theme.DARK]
         self.md = markdown.Markdown(extensions=['fenced_code', 'codehilite'])
+        self._md_style_cache: Dict[Tuple[bool, int], Tuple[Dict[str, str], str]] = {}
+        self._rendered_msg_count = 0
+        # (last session message when it failed, html) for each error bubble,
+        # so a rebuild can redraw it in place.
+        self._error_bubbles: List[Tuple[Optional[Message], str]] = []
         self.thinking_widget = None
         self.max_retries = 2
         self.current_retries = 0
+
+        self._resize_timer = QTimer(self)
+        self._resize_timer.setSingleShot(True)
+        self._resize_timer.setInterval(16)
+        self._resize_timer.timeout.connect(self._update_all_message_widths)
+
+        self._stream_parts: List[str] = []
+        self._stream_tail = ""
+        self._current_request: Optional[Future] = None
+        self._current_request_id: Optional[int] = None
+        self._stream_timer = QTimer(self)
+        self._stream_timer.setSingleShot(True)
+        self._stream_timer.setInterval(50)
+        self._stream_timer.timeout.connect(self._flush_stream)
+
+        self.ai_worker = AsyncOllamaWorker(parent=self)
+        self.ai_worker.chunk.connect(self._handle_ai_chunk)
+        self.ai_worker.finished.connect(self._on_ai_finished)
+        self.ai_worker.error.connect(self._on_ai_error)
+        QApplication.instance().aboutToQuit.connect(self.ai_worker.shutdown)
+
         self.init_ui()
         
     def init_ui(self):
@@ -641,6 +964,15 @@ class ModernChatWidget(QWidget):
         self.update_theme(self.theme_colors)
     
     def get_markdown_styles(self, is_user) -> str:
+        # Entries hold a reference to their colors dict, so the id in the key
+        # cannot be reused and toggling back to a theme hits the cache.
+        key = (is_user, id(self.theme_colors))
+        cached = self._md_style_cache.get(key)
+        if cached is None:
+            cached = self._md_style_cache[key] = (self.theme_colors, self._build_markdown_styles(is_user))
+        return cached[1]
+
+    def _build_markdown_styles(self, is_user) -> str:
         colors = self.theme_colors
         text_color = colors['ChatUserText' if is_user else 'ChatAIText']
         code_bg = colors['Window' if self.theme_colors == THEMES[Theme.DARK] else 'AlternateBase']
@@ -682,12 +1014,13 @@ class ModernChatWidget(QWidget):
                 color: {colors['ChatMeta']};
                 font-style: italic;
             }}
+            .error {{ color: {colors['Error']}; }}
         </style>
         """
 
     def resizeEvent(self, event):
         super().resizeEvent(event)
-        self._update_all_message_widths()
+        self._resize_timer.start()
 
     def _update_all_message_widths(self):
         viewport_width = self.scroll_area.viewport().width()
@@ -699,12 +1032,10 @@ class ModernChatWidget(QWidget):
 
         for i in range(self.chat_layout.count() - 1):
             item = self.chat_layout.itemAt(i)
-            if item and item.widget():
-                container_widget = item.widget()
-                message_widget = container_widget.findChild(ChatMessageWidget)
-                if message_widget:
-                    message_widget.set_max_width(int(max_width))
-                    message_widget.set_min_width(int(min_width))
+            message_widget = item.widget() if item else None
+            if isinstance(message_widget, ChatMessageWidget):
+                message_widget.set_max_width(int(max_width))
+                message_widget.set_min_width(int(min_width))
 
     def update_theme(self, colors: Dict[str, str]):
         self.theme_colors = colors
@@ -764,6 +1095,21 @@ class ModernChatWidget(QWidget):
             }}
         """)
 
+        if len(self.agent.session.messages) != self._rendered_msg_count:
+            self._rebuild_history()
+        else:
+            for i in range(self.chat_layout.count() - 1):
+                item = self.chat_layout.itemAt(i)
+                message_widget = item.widget() if item else None
+                if isinstance(message_widget, ChatMessageWidget):
+                    message_widget.restyle(colors, self.get_markdown_styles(message_widget.is_user))
+
+            if self.thinking_widget:
+                self.thinking_widget.setStyleSheet(f"color: {colors['ChatMeta']}; padding-left: 15px;")
+
+        self._update_all_message_widths()
+
+    def _rebuild_history(self):
         while self.chat_layout.count() > 1:
             item = self.chat_layout.takeAt(0)
             if item and item.widget():
@@ -773,33 +1119,58 @@ class ModernChatWidget(QWidget):
             self.thinking_widget.deleteLater()
             self.thinking_widget = None
         
+        self._draw_error_bubbles(None)
         for message in self.agent.session.messages:
             if message.role == MessageRole.USER:
-                is_user = True
-                escaped_message = html.escape(message.content).replace('\n', '<br>')
-                html_content = self.get_markdown_styles(is_user) + f'<p>{escaped_message}</p>'
-                self._add_message_widget(html_content, is_user)
+                if not message.content.startswith(self._REPROMPT_PREFIX):
+                    is_user = True
+                    self._add_message_widget(message.content, is_user, rich=False)
 
             elif message.role == MessageRole.ASSISTANT:
                 is_user = False
-                response_text = message.content
-                match = re.search(r'```(xml|svg)\s*\n([\s\S]*?)\n```', response_text)
-                
-                chat_text = response_text
-                if match:
-                    chat_text = response_text.replace(match.group(0), '').strip()
-                    if not chat_text:
-                        chat_text = "> [SVG code has been inserted into the editor]"
-                    else:
-                        chat_text += "\n> [SVG code has been inserted into the editor]"
-                
-                html_content = self.get_markdown_styles(is_user) + self.md.convert(chat_text)
-                self._add_message_widget(html_content, is_user)
-        
-        self._update_all_message_widths()
+                self._add_message_widget(self._render_message(message), is_user)
+
+            self._draw_error_bubbles(message)
+
+        self._rendered_msg_count = len(self.agent.session.messages)
+
+    def _draw_error_bubbles(self, anchor: Optional[Message]):
+        for error_anchor, body in self._error_bubbles:
+            if error_anchor is anchor:
+                self._add_message_widget(body, False)
+
+    def _markdown_to_html(self, text: str) -> str:
+        if not self._MARKDOWN_SYNTAX_RE.search(text):
+            return f'<p>{html.escape(text, quote=False)}</p>'
+        # Reset after converting, so the stash and references from this
+        # message are not held until the next one (or leaked on error).
+        try:
+            return self.md.convert(text)
+        finally:
+            self.md.reset()
+
+    def _render_reply_html(self, chat_text: str) -> str:
+        if not chat_text:
+            return self._SVG_NOTE_HTML
+        return self._markdown_to_html(chat_text) + '\n' + self._SVG_NOTE_HTML
+
+    def _render_message(self, message: Message, block: Optional[Tuple[int, int, str]] = None) -> str:
+        # Assistant bodies are theme-independent, so they are rendered once
+        # and kept on the Message; the style prelude is added per widget.
+        if message._rendered_html is None:
+            response_text = message.content
+            block = block or find_svg_block(response_text)
+            if block:
+                block_start, block_end, _ = block
+                chat_text = (response_text[:block_start] + response_text[block_end:]).strip()
+                message._rendered_html = self._render_reply_html(chat_text)
+            else:
+                message._rendered_html = self._markdown_to_html(response_text)
+        return message._rendered_html
 
-    def _add_message_widget(self, text, is_user):
-        message_widget = ChatMessageWidget(text, is_user, self.theme_colors)
+    def _add_message_widget(self, body, is_user, rich=True):
+        styles = self.get_markdown_styles(is_user) if rich else ""
+        message_widget = ChatMessageWidget(body, is_user, self.theme_colors, styles, rich)
         
         viewport_width = self.scroll_area.viewport().width()
         max_width = viewport_width * 0.70
@@ -809,102 +1180,133 @@ class ModernChatWidget(QWidget):
             message_widget.set_max_width(int(max_width))
             message_widget.set_min_width(int(min_width))
 
-        container = QWidget()
-        layout = QHBoxLayout(container)
-        layout.setContentsMargins(0,0,0,0)
-        layout.setSpacing(0)
+        alignment = Qt.AlignmentFlag.AlignRight if is_user else Qt.AlignmentFlag.AlignLeft
+        self.chat_layout.insertWidget(self.chat_layout.count() - 1, message_widget, 0, alignment)
+        
+        self._scroll_to_bottom()
+
+    def _scroll_to_bottom(self):
+        # Deferred to the event loop so the layout has settled and the
+        # scrollbar maximum already accounts for the new widget.
+        scroll_bar = self.scroll_area.verticalScrollBar()
+        QTimer.singleShot(0, lambda: scroll_bar.setValue(scroll_bar.maximum()))
+
+    def _add_session_message(self, message: Message):
+        # Messages added while chatting are handled as they arrive (drawn,
+        # or skipped for retry prompts, as _rebuild_history does), so they
+        # count as rendered; update_theme only rebuilds on a mismatch.
+        self.agent.session.add_message(message)
+        self._rendered_msg_count = len(self.agent.session.messages)
+
+    def _start_worker(self, model_name, messages, options, status_text):
+        # Only one reply streams at a time; a request still in flight is
+        # abandoned so its output can't mix with the new one.
+        if self._current_request is not None:
+            self._current_request.cancel()
+        self._stream_timer.stop()
+        self._stream_parts.clear()
+        self._stream_tail = ""
+        if self.thinking_widget:
+            self.thinking_widget.setText(status_text)
+        self._current_request_id, self._current_request = self.ai_worker.submit(
+            model_name, messages, options, stream=True
+        )
 
-        if is_user:
-            layout.addStretch()
-            layout.addWidget(message_widget)
-        else:
-            layout.addWidget(message_widget)
-            layout.addStretch()
+    def _end_request(self):
+        self._current_request = None
+        self._current_request_id = None
 
-        self.chat_layout.insertWidget(self.chat_layout.count() - 1, container)
-        
-        QApplication.processEvents()
-        self.scroll_area.verticalScrollBar().setValue(self.scroll_area.verticalScrollBar().maximum())
+    def _on_ai_finished(self, request_id: int, response_text: str):
+        # A reply cut short at its closing fence has already been handled,
+        # and replies to abandoned requests are dropped.
+        if request_id != self._current_request_id:
+            return
+        self._end_request()
+        self._handle_ai_response(response_text)
 
-    def _start_worker(self, model_name, messages, options):
-        self.thread = QThread(self)
-        self.worker = OllamaWorker(model_name, messages, options)
-        self.worker.moveToThread(self.thread)
+    def _on_ai_error(self, request_id: int, error_message: str):
+        if request_id != self._current_request_id:
+            return
+        self._end_request()
+        self._handle_ai_error(error_message)
 
-        self.thread.started.connect(self.worker.run)
-        self.worker.finished.connect(self._handle_ai_response)
-        self.worker.error.connect(self._handle_ai_error)
+    def _handle_ai_chunk(self, request_id: int, content: str):
+        # Chunks already queued from an abandoned or finished request must
+        # not reach the buffer the early-finish check below parses.
+        if request_id != self._current_request_id:
+            return
+        self._stream_parts.append(content)
+
+        # Only look for a complete block once a closing fence may have
+        # arrived, checking the new text plus the tail of the previous one.
+        window = self._stream_tail + content
+        self._stream_tail = window[-3:]
+        if '\n```' in window:
+            streamed_text = ''.join(self._stream_parts)
+            if find_svg_block(streamed_text):
+                # Nothing may follow the block, so stop generating now.
+                self._current_request.cancel()
+                self._end_request()
+                self._handle_ai_response(streamed_text)
+                return
 
-        self.worker.finished.connect(self.thread.quit)
-        self.worker.finished.connect(self.worker.deleteLater)
-        self.worker.error.connect(self.thread.quit)
-        self.worker.error.connect(self.worker.deleteLater)
-        self.thread.finished.connect(self.thread.deleteLater)
+        if not self._stream_timer.isActive():
+            self._stream_timer.start()
 
-        self.thread.start()
+    def _flush_stream(self):
+        if self.thinking_widget and self._stream_parts:
+            streamed_text = ''.join(self._stream_parts)
+            self.thinking_widget.setText(html.escape(streamed_text).replace('\n', '<br>'))
         
-    def _trigger_ai_call(self):
+    def _trigger_ai_call(self, status_text: str = "<i>AI is thinking...</i>"):
         context = self.agent.session.get_context_window()
 
         messages = [msg.to_dict() for msg in context]
-        options = {
-            "temperature": self.agent.model_config.temperature,
-            "top_p": self.agent.model_config.top_p,
-            "num_predict": self.agent.model_config.max_tokens,
-            "frequency_penalty": self.agent.model_config.frequency_penalty,
-            "presence_penalty": self.agent.model_config.presence_penalty
-        }
-        self._start_worker(self.agent.model_config.model_name, messages, options)
+        options = self.agent.model_config.to_options()
+        self._start_worker(self.agent.model_config.model_name, messages, options, status_text)
 
     def _retry_ai_request(self, reason: str):
         if self.current_retries < self.max_retries:
             self.current_retries += 1
             logger.info(f"AI response failed: {reason}. Retrying... (Attempt {self.current_retries}/{self.max_retries})")
 
-            if self.thinking_widget:
-                self.thinking_widget.setText(f"<i>AI response invalid. Retrying... (Attempt {self.current_retries}/{self.max_retries})</i>")
-
             reprompt_message = (
-                f"Your previous response was invalid. Reason: {reason}\n\n"
+                f"{self._REPROMPT_PREFIX} Reason: {reason}\n\n"
                 "You MUST follow the strict formatting rules. Your response MUST contain a valid SVG code block. "
                 "The code block must start with ```xml or ```svg. "
                 "There must be absolutely no text after the final ``` that closes the code block. "
                 "Please try again and provide a correctly formatted response for the last user request."
             )
-            self.agent.session.add_message(Message(role=MessageRole.USER, content=reprompt_message))
-            self._trigger_ai_call()
+            self._add_session_message(Message(role=MessageRole.USER, content=reprompt_message))
+            self._trigger_ai_call(f"<i>AI response invalid. Retrying... (Attempt {self.current_retries}/{self.max_retries})</i>")
         else:
             logger.error("AI failed to provide a valid response after all retries.")
             error_message = f"The AI failed to provide a valid SVG response after {self.max_retries + 1} attempts. Please try rephrasing your request."
             self._handle_final_failure(error_message)
 
     def _handle_ai_response(self, response_text):
+        self._stream_timer.stop()
+        self._stream_parts.clear()
+
         if not response_text or not response_text.strip():
             self._retry_ai_request("The AI returned an empty response.")
             return
 
-        match = re.search(r'```(xml|svg)\s*\n([\s\S]*?)\n```', response_text)
-        if not match:
+        block = find_svg_block(response_text)
+        if not block:
             self._retry_ai_request("AI response did not contain a valid SVG code block.")
             return
 
         self.current_retries = 0
-        self.agent.session.add_message(Message(role=MessageRole.ASSISTANT, content=response_text))
+        message = Message(role=MessageRole.ASSISTANT, content=response_text)
+        self._add_session_message(message)
         
         if self.thinking_widget:
             self.thinking_widget.deleteLater()
             self.thinking_widget = None
 
-        svg_code = match.group(2).strip()
-        chat_text = response_text.replace(match.group(0), '').strip()
-        
-        if not chat_text:
-             chat_text = "> [SVG code has been inserted into the editor]"
-        else:
-            chat_text += "\n> [SVG code has been inserted into the editor]"
-
-        html_content = self.get_markdown_styles(False) + self.md.convert(chat_text)
-        self._add_message_widget(html_content, False)
+        svg_code = block[2].strip()
+        self._add_message_widget(self._render_message(message, block), False)
         
         if svg_code:
             self.editor.update_editor_with_svg(svg_code)
@@ -917,46 +1319,81 @@ class ModernChatWidget(QWidget):
             self.thinking_widget.deleteLater()
             self.thinking_widget = None
 
-        error_color = self.theme_colors["Error"]
-        html_content = self.get_markdown_styles(False) + f'<b style="color:{error_color};">ERROR</b><br>{html.escape(error_message)}'
-        self._add_message_widget(html_content, False)
+        body = f'<b class="error">ERROR</b><br>{html.escape(error_message)}'
+        messages = self.agent.session.messages
+        self._error_bubbles.append((messages[-1] if messages else None, body))
+        self._add_message_widget(body, False)
         
         self.send_button.setEnabled(True)
         self.input_field.setFocus()
         self.current_retries = 0
 
     def _handle_ai_error(self, error_message: str):
+        self._stream_timer.stop()
+        self._stream_parts.clear()
         logger.error(f"Ollama worker error: {error_message}")
         final_message = f"An unexpected error occurred while communicating with the AI: {error_message}"
         self._handle_final_failure(final_message)
 
     def send_message(self):
         user_message = self.input_field.text().strip()
-        if not user_message:
+        # Enter still reaches here while the Send button is disabled.
+        if not user_message or self._current_request is not None:
             return
 
         self.send_button.setEnabled(False)
         self.input_field.clear()
         
-        escaped_message = html.escape(user_message).replace('\n', '<br>')
-        html_content = self.get_markdown_styles(True) + f'<p>{escaped_message}</p>'
-        self._add_message_widget(html_content, True)
+        self._add_message_widget(user_message, True, rich=False)
 
         self.thinking_widget = QLabel("<i>AI is thinking...</i>")
+        # Streamed text is escaped into HTML, so never let Qt guess the format.
+        self.thinking_widget.setTextFormat(Qt.TextFormat.RichText)
+        self.thinking_widget.setWordWrap(True)
         self.thinking_widget.setStyleSheet(f"color: {self.theme_colors['ChatMeta']}; padding-left: 15px;")
         self.chat_layout.insertWidget(self.chat_layout.count() - 1, self.thinking_widget)
         
-        QApplication.processEvents()
-        self.scroll_area.verticalScrollBar().setValue(self.scroll_area.verticalScrollBar().maximum())
+        self._scroll_to_bottom()
         
         self.current_retries = 0
-        self.agent.session.add_message(Message(role=MessageRole.USER, content=user_message))
+        self._add_session_message(Message(role=MessageRole.USER, content=user_message))
         self._trigger_ai_call()
 
+def is_well_formed_xml(text: str) -> bool:
+    # Streaming scan that stops at the first error, without building the
+    # document QSvgRenderer would.
+    reader = QXmlStreamReader(text)
+    while not reader.atEnd() and not reader.hasError():
+        reader.readNext()
+    return not reader.hasError()
+
+def pretty_print_svg(xml_str: str) -> str:
+    # Both backends raise a SyntaxError subclass on malformed XML
+    # (lxml's XMLSyntaxError, ElementTree's ParseError).
+    if etree is None:
+        ET.fromstring(xml_str)
+        formatted_xml = minidom.parseString(xml_str).toprettyxml(indent="    ")
+        # toprettyxml always starts with an XML declaration; drop it so the
+        # output matches the lxml path.
+        _, _, formatted_xml = formatted_xml.partition('?>')
+        return '\n'.join(line for line in formatted_xml.split('\n') if line.strip())
+
+    # The text is always handed over as UTF-8, whatever encoding the
+    # document's own XML declaration names.
+    parser = etree.XMLParser(remove_blank_text=True, encoding='utf-8')
+    root = etree.fromstring(xml_str.encode('utf-8'), parser)
+    etree.indent(root, space="    ")
+    # Serialize the whole tree so a DOCTYPE and any top-level comments or
+    # processing instructions around the root survive formatting.
+    return etree.tostring(root.getroottree(), encoding='unicode')
+
 class SVGEditor(QMainWindow):
     def __init__(self):
         super().__init__()
         self.current_theme = Theme.DARK
+        self._applied_theme = None
+        self._last_svg_text: Optional[str] = None
+        self._palette_cache: Dict[str, QPalette] = {}
         self.initUI()
         self.apply_theme()
 
@@ -983,7 +1420,11 @@ class SVGEditor(QMainWindow):
         font.setStyleHint(QFont.StyleHint.Monospace)
         self.code_editor.setFont(font)
         self.code_editor.setLineWrapMode(QTextEdit.LineWrapMode.NoWrap)
-        self.code_editor.textChanged.connect(self.update_svg)
+        self._svg_update_timer = QTimer(self)
+        self._svg_update_timer.setSingleShot(True)
+        self._svg_update_timer.setInterval(150)
+        self._svg_update_timer.timeout.connect(self.update_svg)
+        self.code_editor.textChanged.connect(self._svg_update_timer.start)
         editor_layout.addWidget(self.code_editor)
         self.tool_tabs.addTab(editor_widget, "Code Editor")
 
@@ -1063,9 +1504,16 @@ class SVGEditor(QMainWindow):
         self.apply_theme()
 
     def apply_theme(self):
+        if self._applied_theme == self.current_theme:
+            return
+        self._applied_theme = self.current_theme
+
         theme_colors = THEMES[self.current_theme]
+        palette = self._palette_cache.get(self.current_theme)
+        if palette is None:
+            palette = self._palette_cache[self.current_theme] = get_palette(self.current_theme)
         app = QApplication.instance()
-        app.setPalette(get_palette(self.current_theme))
+        app.setPalette(palette)
         app.setStyleSheet(get_stylesheet(self.current_theme))
         
         self.highlighter.update_theme(theme_colors)
@@ -1075,23 +1523,34 @@ class SVGEditor(QMainWindow):
 
     def update_editor_with_svg(self, svg_code):
         try:
-            ET.fromstring(svg_code)
-            formatted_xml = minidom.parseString(svg_code).toprettyxml(indent="    ")
-            formatted_xml = '\n'.join(line for line in formatted_xml.split('\n') if line.strip())
-            self.code_editor.setPlainText(formatted_xml)
+            formatted_xml = pretty_print_svg(svg_code)
+            self.set_editor_text(formatted_xml)
             self.statusBar.showMessage("SVG code updated from AI", 3000)
-        except ET.ParseError as e:
-            self.code_editor.setPlainText(svg_code)
+        except SyntaxError as e:
+            self.set_editor_text(svg_code)
             self.statusBar.showMessage(f"Invalid SVG from AI, inserted raw code: {str(e)}", 5000)
 
+    def set_editor_text(self, text: str):
+        # Whole-document replacements (AI output, opened files, formatting)
+        # are not typing bursts, so render them without the debounce delay.
+        self.code_editor.setPlainText(text)
+        self._svg_update_timer.stop()
+        self.update_svg()
+
     def update_svg(self):
         try:
             svg_code = self.code_editor.toPlainText()
+            if svg_code == self._last_svg_text:
+                return
+            self._last_svg_text = svg_code
             if not svg_code.strip():
-                self.preview_frame.svg_widget.load(QByteArray())
+                self.preview_frame.svg_widget.load_svg("")
+                return
+            if not is_well_formed_xml(svg_code):
+                self.statusBar.showMessage("Invalid SVG syntax", 4000)
+                return
+            if not self.preview_frame.svg_widget.load_svg(svg_code):
                 return
-            svg_bytes = QByteArray(svg_code.encode('utf-8'))
-            self.preview_frame.svg_widget.load(svg_bytes)
             if not self.preview_frame.svg_widget.renderer().isValid():
                 self.statusBar.showMessage("Invalid SVG syntax", 4000)
             else:
@@ -1116,7 +1575,7 @@ class SVGEditor(QMainWindow):
             
     <polygon points="100,60 120,100 100,140 80,100" fill="#FFFFFF" opacity="0.8" />
 </svg>'''
-        self.code_editor.setPlainText(default_svg)
+        self.set_editor_text(default_svg)
 
     def new_file(self):
         reply = QMessageBox.question(self, 'New File',
@@ -1134,7 +1593,7 @@ class SVGEditor(QMainWindow):
         if fname:
             try:
                 with open(fname, 'r', encoding='utf-8') as f:
-                    self.code_editor.setPlainText(f.read())
+                    self.set_editor_text(f.read())
                 self.statusBar.showMessage(f"Opened {fname}", 3000)
             except Exception as e:
                 QMessageBox.critical(self, 'Error', f'Could not open file: {str(e)}')
@@ -1157,10 +1616,8 @@ class SVGEditor(QMainWindow):
             if not xml_str.strip():
                 self.statusBar.showMessage("Nothing to format.", 3000)
                 return
-            root = ET.fromstring(xml_str)
-            formatted_xml = minidom.parseString(ET.tostring(root)).toprettyxml(indent="    ")
-            formatted_xml = '\n'.join(line for line in formatted_xml.split('\n') if line.strip())[formatted_xml.find('?>')+2:].strip()
-            self.code_editor.setPlainText(formatted_xml)
+            formatted_xml = pretty_print_svg(xml_str)
+            self.set_editor_text(formatted_xml)
             self.statusBar.showMessage("Code formatted successfully", 3000)
         except Exception as e:
             QMessageBox.warning(self, 'Format Error', f'Could not format XML: {str(e)}')